@@ -1,51 +1,347 @@
+import atexit
+import hashlib
 import os
 import time
+import orjson
+import redis
 import requests
-from collections import defaultdict, Counter
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+from requests.adapters import HTTPAdapter
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import groupby
+from math import inf
+from operator import itemgetter
+from contextlib import contextmanager
+from threading import Lock, RLock
+from cachetools import LRUCache, TLRUCache, TTLCache
+from flask import Flask, render_template, request
+from flask_compress import Compress
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos al persistir el geocoding
+    fcntl = None
+
 # Carga variables de entorno desde .env
 load_dotenv()
 
 API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
 DEFAULT_UNITS = os.getenv("DEFAULT_UNITS", "metric")  # metric | imperial
 DEFAULT_LANG = os.getenv("DEFAULT_LANG", "es")
+# Hilos por worker de gunicorn (mismo valor que lee gunicorn_conf.py)
+WORKER_THREADS = int(os.getenv("GUNICORN_THREADS", "8"))
+# Opcional: cache compartido entre workers (p.ej. redis://localhost:6379/0)
+REDIS_URL = os.getenv("REDIS_URL", "")
+# Timeout corto: si Redis se cuelga preferimos un miss a bloquear el request
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.25"))  # segundos
+# Conexiones por worker: hilos de gunicorn + hilos de _executor (2 por hilo)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", str(3 * WORKER_THREADS)))
+# Archivo donde persistimos el geocoding (ciudad -> lat/lon) entre reinicios
+GEOCACHE_FILE = os.getenv("GEOCACHE_FILE", "geocache.json")
 
 app = Flask(__name__)
+# Comprime (gzip/br) las respuestas HTML y JSON según Accept-Encoding del cliente
+Compress(app)
 
-# Cache en memoria (simple) por 5 minutos
+# Cache en memoria por 5 minutos (acotado y con expiración por entrada)
 CACHE_TTL = 300  # segundos
-# Estructura: clave -> (timestamp, data)
+# Estructura: clave -> (expira_en, data); expira_en en reloj time.monotonic().
+# Cada entrada vence en su propio instante: lo que llega desde Redis hereda
+# el TTL restante de L2 en vez de un CACHE_TTL completo.
 # Para evitar colisiones entre "actual" y "forecast" añadimos un prefijo en la clave
-_cache = {}
+_cache = TLRUCache(maxsize=1024, ttu=lambda _key, entry, _now: entry[0], timer=time.monotonic)
+# TLRUCache no es thread-safe: protegemos lecturas/escrituras entre hilos
+_lock = RLock()
+# Segundo nivel (L2) compartido entre procesos; sólo si hay REDIS_URL.
+# El pool bloqueante espera (hasta REDIS_TIMEOUT) una conexión libre en vez de
+# fallar con "Too many connections" bajo carga.
+_redis = (redis.Redis(connection_pool=redis.BlockingConnectionPool.from_url(
+              REDIS_URL,
+              max_connections=REDIS_MAX_CONNECTIONS,
+              timeout=REDIS_TIMEOUT,
+              socket_timeout=REDIS_TIMEOUT,
+              socket_connect_timeout=REDIS_TIMEOUT))
+          if REDIS_URL else None)
+# Páginas ya renderizadas de /weather: clave (ciudad, units, lang) ->
+# (expira_en, HTML). Cada página vence cuando vence el primero de los datos
+# (actual / pronóstico) con que se armó, no CACHE_TTL después de guardarla.
+_html_cache = TLRUCache(maxsize=256, ttu=lambda _key, entry, _now: entry[0], timer=time.monotonic)
+# Validadores HTTP (ETag / Last-Modified) por clave: sobreviven al TTL del cache
+# para poder revalidar con una petición condicional y aceptar un 304.
+VALIDATOR_TTL = 24 * 3600  # segundos
+# Estructura: clave -> (data, etag, last_modified)
+_validators = TTLCache(maxsize=1024, ttl=VALIDATOR_TTL)
+
+# Geocoding persistente: nombre normalizado -> (lat, lon, nombre, país,
+# último_uso), con lat/lon redondeados y último_uso en time.time() (comparable
+# entre procesos). Consultar por coordenadas evita el geocoder de texto de
+# OpenWeather en cada llamada y unifica variantes como "Buenos Aires" /
+# "buenos aires". Acotado por recencia (LRU) en memoria y en disco.
+GEO_CACHE_MAX = 4096
+_geo_cache = LRUCache(maxsize=GEO_CACHE_MAX)
+_geo_lock = Lock()
+# Ciudades que el geocoder no reconoció: se rechazan sin volver a la red
+UNKNOWN_CITY_TTL = 24 * 3600  # segundos
+_unknown_cities = TTLCache(maxsize=4096, ttl=UNKNOWN_CITY_TTL)
+MAX_CITY_LEN = 100
+
+# Un lock por clave en vuelo para que peticiones concurrentes a la misma
+# ciudad hagan una sola llamada a OpenWeather.
+# Estructura: clave -> [lock, hilos_esperando]
+_inflight = {}
+_inflight_lock = Lock()
+
+# Sesión HTTP compartida: reutiliza conexiones (keep-alive) hacia OpenWeather
+# en vez de abrir un TCP+TLS nuevo en cada llamada.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+# requests descomprime de forma transparente; pedimos gzip para reducir el tráfico
+_session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+
+# Pool de hilos para lanzar en paralelo clima actual + pronóstico en /weather.
+# Cada request encola 2 tareas: dimensionado para que con todos los hilos de
+# gunicorn ocupados ninguna tarea quede esperando en cola.
+_executor = ThreadPoolExecutor(max_workers=2 * WORKER_THREADS, thread_name_prefix="owm")
 
 # ------------------------------
 # Utilidades auxiliares
 # ------------------------------
 
+# Versión del formato guardado en Redis: subirla cuando cambie la forma de los
+# datos cacheados, para que workers nuevos no lean entradas de un deploy viejo.
+REDIS_PREFIX = "ow:v2:"
+
+def _redis_key(key_tuple):
+    """Clave de Redis a partir de la tupla, p.ej. 'ow:v2:current:-34.61:-58.38:metric:es'."""
+    return REDIS_PREFIX + ":".join(map(str, key_tuple))
+
 def _cache_get(key_tuple):
-    """Recupera de cache si no está vencido."""
-    now = time.time()
-    if key_tuple in _cache:
-        ts, data = _cache[key_tuple]
-        if now - ts < CACHE_TTL:
+    """Recupera de cache si no está vencido: primero L1 (proceso), luego L2 (Redis)."""
+    with _lock:
+        try:
+            return _cache[key_tuple][1], True
+        except KeyError:
+            pass
+    if _redis is not None:
+        rkey = _redis_key(key_tuple)
+        try:
+            # Valor y TTL restante (ms) en un solo viaje
+            raw, ttl_ms = _redis.pipeline(transaction=False).get(rkey).pttl(rkey).execute()
+        except redis.RedisError:
+            raw = None  # si Redis no responde, seguimos sólo con L1
+        if raw is not None:
+            data = orjson.loads(raw)
+            if ttl_ms > 0:
+                with _lock:
+                    _cache[key_tuple] = (time.monotonic() + ttl_ms / 1000, data)
             return data, True
     return None, False
 
-def _cache_set(key_tuple, data):
-    """Guarda en cache con timestamp actual."""
-    _cache[key_tuple] = (time.time(), data)
+def _cache_expires_at(key_tuple):
+    """Instante (time.monotonic) en que vence la entrada L1, o None si no está."""
+    with _lock:
+        entry = _cache.get(key_tuple)
+    return entry[0] if entry else None
+
+def _data_expires_at(kind, city, units, lang):
+    """
+    Vencimiento en L1 de los datos `kind` ('current' / 'forecast') de una
+    ciudad ya consultada; None si no están en cache.
+    """
+    lat, lon = _geocode(city)[:2]  # ya resuelta: sólo lectura de cache
+    return _cache_expires_at((kind, lat, lon, units, lang))
+
+def _cache_set(key_tuple, data, etag=None, last_modified=None):
+    """Guarda en cache por CACHE_TTL junto con sus validadores HTTP."""
+    with _lock:
+        _cache[key_tuple] = (time.monotonic() + CACHE_TTL, data)
+        if etag or last_modified:
+            _validators[key_tuple] = (data, etag, last_modified)
+    if _redis is not None:
+        try:
+            _redis.setex(_redis_key(key_tuple), CACHE_TTL, orjson.dumps(data))
+        except redis.RedisError:
+            pass
+
+def _conditional_get(url, params, key_tuple):
+    """
+    GET a OpenWeather enviando If-None-Match / If-Modified-Since si tenemos
+    validadores de una respuesta anterior.
+    Devuelve (resp, None) o, si el servidor respondió 304, (None, data_guardada)
+    tras refrescar el TTL en cache.
+    """
+    with _lock:
+        stale = _validators.get(key_tuple)
+    headers = {}
+    if stale:
+        _, etag, last_modified = stale
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    resp = get_session().get(url, params=params, headers=headers, timeout=10)
+    if resp.status_code == 304 and stale:
+        _cache_set(key_tuple, *stale)
+        return None, stale[0]
+    return resp, None
+
+@contextmanager
+def _inflight_for(key_tuple):
+    """Serializa las descargas concurrentes de una misma clave (evita el "thundering herd")."""
+    with _inflight_lock:
+        entry = _inflight.get(key_tuple)
+        if entry is None:
+            entry = _inflight[key_tuple] = [Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _inflight_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _inflight[key_tuple]
+
+def get_session():
+    """Devuelve la sesión HTTP compartida (útil para inyectar un mock en tests)."""
+    return _session
+
+def _api_error(resp):
+    """Construye un ValueError legible a partir de una respuesta de error del API."""
+    try:
+        err = orjson.loads(resp.content)
+    except orjson.JSONDecodeError:
+        err = {"message": resp.text}
+    return ValueError(f"Error de API ({resp.status_code}): {err.get('message','sin detalle')}")
 
+def _read_geocache_file():
+    """Lee GEOCACHE_FILE -> {ciudad: (lat, lon, nombre, país, último_uso)}; vacío si no existe."""
+    try:
+        with open(GEOCACHE_FILE, "rb") as fh:
+            stored = orjson.loads(fh.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    return {city: tuple(entry) for city, entry in stored.items()
+            if isinstance(entry, list) and len(entry) == 5}
+
+def _load_geocache():
+    """Carga el geocoding persistido en GEOCACHE_FILE (si existe)."""
+    stored = _read_geocache_file()
+    with _geo_lock:
+        # De más viejo a más reciente, para que el orden LRU refleje el uso real
+        for city, entry in sorted(stored.items(), key=lambda item: item[1][4]):
+            _geo_cache[city] = entry
+
+def _geo_touch(norm):
+    """
+    Busca en el geocoding y registra el uso (llamar con _geo_lock tomado).
+    Devuelve (lat, lon, nombre, país) o None.
+    """
+    entry = _geo_cache.get(norm)
+    if entry is None:
+        return None
+    _geo_cache[norm] = (*entry[:4], time.time())
+    return entry[:4]
+
+def save_geocache():
+    """
+    Persiste el geocoding en GEOCACHE_FILE fusionándolo con lo que ya hay en
+    disco (otros workers pueden haber guardado antes). Escritura atómica y, en
+    Unix, serializada entre procesos con un lock de archivo.
+    Se llama al salir de cada worker de gunicorn (ver gunicorn_conf.py) o de
+    `python app.py`; nunca desde el proceso maestro, que sólo tiene la foto
+    cargada al importar. Con `flask run` no se persiste.
+    """
+    with _geo_lock:
+        current = dict(_geo_cache)
+    if not current:
+        return
+    try:
+        with open(f"{GEOCACHE_FILE}.lock", "w") as lock_fh:
+            if fcntl is not None:
+                fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            merged = _read_geocache_file()
+            for city, entry in current.items():
+                # Gana el uso más reciente, venga de este worker o de otro
+                if city not in merged or entry[4] >= merged[city][4]:
+                    merged[city] = entry
+            # Mismo tope que en memoria: descartamos lo usado hace más tiempo
+            keep = sorted(merged.items(), key=lambda item: item[1][4])[-GEO_CACHE_MAX:]
+            tmp = f"{GEOCACHE_FILE}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(orjson.dumps(dict(keep)))
+            os.replace(tmp, GEOCACHE_FILE)
+    except OSError:
+        pass
+
+_load_geocache()
+
+def _geocode(city: str):
+    """
+    Resuelve una ciudad a (lat, lon, nombre, país) con el endpoint
+    /geo/1.0/direct, una sola vez por nombre normalizado. Coordenadas
+    redondeadas a 2 decimales (~1 km) para que distintas escrituras de la
+    misma ciudad compartan cache.
+    """
+    norm = city.lower().strip()
+    # Entradas imposibles (sin letras o demasiado largas) no llegan al API
+    if len(norm) > MAX_CITY_LEN or not any(ch.isalpha() for ch in norm):
+        raise ValueError("Ciudad no válida.")
+    with _geo_lock:
+        coords = _geo_touch(norm)
+        unknown = norm in _unknown_cities
+    if coords:
+        return coords
+    if unknown:
+        raise ValueError("Ciudad no encontrada.")
+
+    with _inflight_for(("geo", norm)):
+        # Otro hilo pudo haberla resuelto (o descartado) mientras esperábamos
+        with _geo_lock:
+            coords = _geo_touch(norm)
+            unknown = norm in _unknown_cities
+        if coords:
+            return coords
+        if unknown:
+            raise ValueError("Ciudad no encontrada.")
+
+        url = "https://api.openweathermap.org/geo/1.0/direct"
+        params = {"q": city, "limit": 1, "appid": API_KEY}
+        resp = get_session().get(url, params=params, timeout=10)
+        if resp.status_code != 200:
+            raise _api_error(resp)
+        results = orjson.loads(resp.content)
+        if not results:
+            with _geo_lock:
+                _unknown_cities[norm] = True
+            raise ValueError("Ciudad no encontrada.")
+        place = results[0]
+        coords = (round(place["lat"], 2), round(place["lon"], 2),
+                  place.get("name", city), place.get("country", ""))
+        with _geo_lock:
+            _geo_cache[norm] = (*coords, time.time())
+        return coords
+
+_DIAS = ("Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom")
+
+# Códigos de ícono de OpenWeather (conjunto fijo): contamos en un arreglo por índice
+_ICON_CODES = (
+    "01d", "01n", "02d", "02n", "03d", "03n", "04d", "04n", "09d",
+    "09n", "10d", "10n", "11d", "11n", "13d", "13n", "50d", "50n",
+)
+_ICON_IDX = {code: i for i, code in enumerate(_ICON_CODES)}
+
+@lru_cache(maxsize=512)
 def _weekday_es(date_str):
     """
     Devuelve abreviatura de día en español: Lun, Mar, Mié, Jue, Vie, Sáb, Dom
-    date_str: 'YYYY-MM-DD'
+    date_str: 'YYYY-MM-DD' (formato fijo: evitamos el costoso strptime)
     """
-    dt = datetime.strptime(date_str, "%Y-%m-%d")
-    dias = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
-    return dias[dt.weekday()]
+    y, m, d = int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])
+    return _DIAS[date(y, m, d).weekday()]
 
 
 def _format_local_time(timestamp, tz_offset):
@@ -57,6 +353,33 @@ def _format_local_time(timestamp, tz_offset):
     except (TypeError, ValueError, OSError):
         return None
 
+def summarize_current(weather_json):
+    """
+    Recibe el JSON del endpoint /weather y lo aplana a los campos que usan
+    las vistas, para no recorrer el dict anidado en cada respuesta servida
+    desde cache (se guarda este resumen, no el JSON crudo).
+    """
+    sys_block = weather_json.get("sys", {})
+    main = weather_json.get("main", {})
+    weather_list = weather_json.get("weather", [])
+    w = weather_list[0] if weather_list else {}
+    return {
+        "name": weather_json.get("name", ""),
+        "country": sys_block.get("country", ""),
+        "temp": main.get("temp"),
+        "feels_like": main.get("feels_like"),
+        "humidity": main.get("humidity"),
+        "pressure": main.get("pressure"),
+        "desc": w.get("description", ""),
+        "icon": w.get("icon"),
+        "wind_speed": weather_json.get("wind", {}).get("speed"),
+        "clouds": weather_json.get("clouds", {}).get("all"),
+        "timezone": weather_json.get("timezone"),  # segundos de diferencia vs UTC
+        "dt": weather_json.get("dt"),              # timestamp base (UTC) de la medición
+        "sunrise": sys_block.get("sunrise"),       # timestamps UTC crudos
+        "sunset": sys_block.get("sunset"),
+    }
+
 def summarize_forecast(forecast_json):
     """
     Recibe el JSON del endpoint /forecast (bloques de 3h por ~5 días)
@@ -68,48 +391,59 @@ def summarize_forecast(forecast_json):
     - pop (probabilidad de precipitación) promedio del día (0..1)
     """
     items = forecast_json.get("list", [])
-    # Agrupa por 'YYYY-MM-DD' usando dt_txt
-    by_day = defaultdict(list)
-    for it in items:
-        dt_txt = it.get("dt_txt")  # 'YYYY-MM-DD HH:MM:SS'
-        if not dt_txt:
-            # fallback por si no viene dt_txt
+
+    def _keyed():
+        """Normaliza cada bloque a (YYYY-MM-DD, bloque) usando dt_txt."""
+        for it in items:
+            dt_txt = it.get("dt_txt")  # 'YYYY-MM-DD HH:MM:SS'
+            if dt_txt:
+                yield dt_txt[:10], it
+                continue
+            # fallback por si no viene dt_txt: sólo necesitamos la fecha UTC
             dt = it.get("dt")
             if dt is None:
                 continue
-            dt_txt = datetime.utcfromtimestamp(dt).strftime("%Y-%m-%d %H:%M:%S")
-        day_key = dt_txt[:10]
-        by_day[day_key].append(it)
+            yield datetime.utcfromtimestamp(dt).date().isoformat(), it
 
     daily = []
-    for day_key in sorted(by_day.keys()):
-        blocks = by_day[day_key]
-        # Listas de min/max y recolección de weather
-        mins, maxs, pops = [], [], []
-        descs, icons = [], []
-        for b in blocks:
+    # El API entrega los bloques ordenados por hora: agrupamos en streaming
+    # por 'YYYY-MM-DD' sin dict intermedio ni ordenar claves.
+    for day_key, group in groupby(_keyed(), key=itemgetter(0)):
+        # Una sola pasada: min/max/suma acumulados y frecuencia de desc/icon
+        tmin, tmax = inf, -inf
+        psum, pn = 0.0, 0
+        descf = defaultdict(int)
+        icon_counts = [0] * len(_ICON_CODES)
+        icon_seen = []  # índices en orden de aparición (desempate igual que desc)
+        for _, b in group:
             main = b.get("main", {})
             weather_arr = b.get("weather", [])
-            if "temp_min" in main:
-                mins.append(main["temp_min"])
-            if "temp_max" in main:
-                maxs.append(main["temp_max"])
+            if "temp_min" in main and main["temp_min"] < tmin:
+                tmin = main["temp_min"]
+            if "temp_max" in main and main["temp_max"] > tmax:
+                tmax = main["temp_max"]
             # Probabilidad de precipitación (0..1). No siempre viene, asumimos 0 si falta
-            pops.append(b.get("pop", 0))
+            psum += b.get("pop", 0)
+            pn += 1
             if weather_arr:
                 w = weather_arr[0]
-                descs.append(w.get("description", ""))
-                icons.append(w.get("icon", ""))
+                d = w.get("description", "")
+                if d:
+                    descf[d] += 1
+                idx = _ICON_IDX.get(w.get("icon"))
+                if idx is not None:
+                    if not icon_counts[idx]:
+                        icon_seen.append(idx)
+                    icon_counts[idx] += 1
 
         # Si no hay datos suficientes, saltamos ese día
-        if not mins or not maxs:
+        if tmin == inf or tmax == -inf:
             continue
 
-        # Más frecuente para desc/icon (representativo del día)
-        desc = Counter([d for d in descs if d]).most_common(1)
-        icon = Counter([i for i in icons if i]).most_common(1)
-        rep_desc = desc[0][0] if desc else ""
-        rep_icon = icon[0][0] if icon else None
+        # Más frecuente para desc/icon (representativo del día); O(n) sin ordenar
+        rep_desc = max(descf, key=descf.get) if descf else ""
+        rep_icon = (_ICON_CODES[max(icon_seen, key=icon_counts.__getitem__)]
+                    if icon_seen else None)
 
         # Etiqueta bonita: 'Lun 06'
         day_tag = f"{_weekday_es(day_key)} {day_key[-2:]}"
@@ -117,11 +451,11 @@ def summarize_forecast(forecast_json):
         daily.append({
             "date": day_key,
             "day": day_tag,
-            "temp_min": round(min(mins), 1),
-            "temp_max": round(max(maxs), 1),
+            "temp_min": round(tmin, 1),
+            "temp_max": round(tmax, 1),
             "desc": rep_desc,
             "icon": rep_icon,
-            "pop": round(sum(pops) / len(pops), 2) if pops else 0.0,  # promedio
+            "pop": round(psum / pn, 2) if pn else 0.0,  # promedio
         })
 
     # Nos quedamos con los próximos 5 días (el API suele traer hasta 5)
@@ -134,63 +468,76 @@ def summarize_forecast(forecast_json):
 def fetch_weather(city: str, units: str, lang: str):
     """
     Clima actual para una ciudad (endpoint 'weather').
-    Devuelve (json, from_cache: bool)
+    Devuelve (resumen_plano, from_cache: bool); ver summarize_current.
     """
-    key = ("current", city.lower().strip(), units, lang)
+    lat, lon, name, country = _geocode(city)
+    data, from_cache = _fetch_current(lat, lon, units, lang)
+    # Por coordenadas el API nombra la estación más cercana, que puede no ser
+    # la ciudad pedida: mostramos el nombre que resolvió el geocoder.
+    return {**data, "name": name, "country": country}, from_cache
+
+def _fetch_current(lat, lon, units: str, lang: str):
+    """Clima actual por coordenadas (con cache). Devuelve (resumen_plano, from_cache)."""
+    key = ("current", lat, lon, units, lang)
     data, from_cache = _cache_get(key)
     if from_cache:
         return data, True
 
-    url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {
-        "q": city,
-        "appid": API_KEY,
-        "units": units,  # metric (°C) | imperial (°F)
-        "lang": lang,    # 'es' para descripciones en español
-    }
-    resp = requests.get(url, params=params, timeout=10)
-    if resp.status_code != 200:
-        # Intenta extraer mensaje de error legible
-        try:
-            err = resp.json()
-        except Exception:
-            err = {"message": resp.text}
-        raise ValueError(f"Error de API ({resp.status_code}): {err.get('message','sin detalle')}")
+    with _inflight_for(key):
+        # Otro hilo pudo haberla cargado mientras esperábamos el lock
+        data, from_cache = _cache_get(key)
+        if from_cache:
+            return data, True
 
-    data = resp.json()
-    _cache_set(key, data)
-    return data, False
+        url = "https://api.openweathermap.org/data/2.5/weather"
+        # Tupla de pares: requests la codifica directo, sin armar un dict por llamada
+        params = (("lat", lat), ("lon", lon), ("appid", API_KEY),
+                  ("units", units), ("lang", lang))  # metric (°C) | imperial (°F); 'es'
+        resp, revalidated = _conditional_get(url, params, key)
+        if resp is None:
+            return revalidated, True
+        if resp.status_code != 200:
+            # Intenta extraer mensaje de error legible
+            raise _api_error(resp)
+
+        data = summarize_current(orjson.loads(resp.content))
+        _cache_set(key, data, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return data, False
 
 def fetch_forecast(city: str, units: str, lang: str):
     """
     Pronóstico 5 días/3 h (endpoint 'forecast') y resumen diario.
     Devuelve (lista_resumen, from_cache: bool)
     """
-    key = ("forecast", city.lower().strip(), units, lang)
+    lat, lon = _geocode(city)[:2]
+    key = ("forecast", lat, lon, units, lang)
     data, from_cache = _cache_get(key)
     if from_cache:
         # Si viene de cache, ya guardamos el JSON resumido (no el crudo)
         return data, True
 
-    url = "https://api.openweathermap.org/data/2.5/forecast"
-    params = {
-        "q": city,
-        "appid": API_KEY,
-        "units": units,
-        "lang": lang,
-    }
-    resp = requests.get(url, params=params, timeout=10)
-    if resp.status_code != 200:
-        try:
-            err = resp.json()
-        except Exception:
-            err = {"message": resp.text}
-        raise ValueError(f"Error de API ({resp.status_code}): {err.get('message','sin detalle')}")
+    with _inflight_for(key):
+        # Otro hilo pudo haberla cargado mientras esperábamos el lock
+        data, from_cache = _cache_get(key)
+        if from_cache:
+            return data, True
 
-    raw = resp.json()
-    daily_summary = summarize_forecast(raw)
-    _cache_set(key, daily_summary)  # guardamos ya el resumen
-    return daily_summary, False
+        url = "https://api.openweathermap.org/data/2.5/forecast"
+        # Tupla de pares: requests la codifica directo, sin armar un dict por llamada
+        params = (("lat", lat), ("lon", lon), ("appid", API_KEY),
+                  ("units", units), ("lang", lang))  # metric (°C) | imperial (°F); 'es'
+        resp, revalidated = _conditional_get(url, params, key)
+        if resp is None:
+            # 304: el pronóstico no cambió, reutilizamos el resumen guardado
+            return revalidated, True
+        if resp.status_code != 200:
+            raise _api_error(resp)
+
+        raw = orjson.loads(resp.content)
+        daily_summary = summarize_forecast(raw)
+        # guardamos ya el resumen
+        _cache_set(key, daily_summary, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return daily_summary, False
 
 # ------------------------------
 # Rutas de páginas (clásico)
@@ -238,32 +585,34 @@ def weather():
                                default_lang=lang,
                                from_cache=False)
 
+    html_key = (city.lower(), units, lang)
+    with _lock:
+        entry = _html_cache.get(html_key)
+    if entry is not None:
+        return entry[1]
+
     try:
-        # Clima actual
-        data_current, from_cache_current = fetch_weather(city, units, lang)
-
-        # Parseo básico de clima actual
-        name = data_current.get("name", city)
-        sys = data_current.get("sys", {})
-        country = sys.get("country", "")
-        main = data_current.get("main", {})
-        weather_list = data_current.get("weather", [])
-        wind = data_current.get("wind", {})
-
-        tz_offset = data_current.get("timezone", 0) or 0
+        # Clima actual y pronóstico 5 días en paralelo (misma sesión keep-alive)
+        fut_current = _executor.submit(fetch_weather, city, units, lang)
+        fut_forecast = _executor.submit(fetch_forecast, city, units, lang)
+        data_current, from_cache_current = fut_current.result()
+
+        name = data_current["name"] or city
+        country = data_current["country"]
+        tz_offset = data_current["timezone"] or 0
         result = {
             "city": f"{name}, {country}" if country else name,
-            "temp": main.get("temp"),
-            "feels_like": main.get("feels_like"),
-            "humidity": main.get("humidity"),
-            "pressure": main.get("pressure"),
-            "desc": weather_list[0]["description"] if weather_list else "Sin descripción",
-            "icon": weather_list[0]["icon"] if weather_list else None,
-            "wind_speed": wind.get("speed"),
+            "temp": data_current["temp"],
+            "feels_like": data_current["feels_like"],
+            "humidity": data_current["humidity"],
+            "pressure": data_current["pressure"],
+            "desc": data_current["desc"] or "Sin descripción",
+            "icon": data_current["icon"],
+            "wind_speed": data_current["wind_speed"],
             "units": units,  # para mostrar °C u °F
-            "sunrise": _format_local_time(sys.get("sunrise"), tz_offset),
-            "sunset": _format_local_time(sys.get("sunset"), tz_offset),
-            "clouds": data_current.get("clouds", {}).get("all"),
+            "sunrise": _format_local_time(data_current["sunrise"], tz_offset),
+            "sunset": _format_local_time(data_current["sunset"], tz_offset),
+            "clouds": data_current["clouds"],
         }
 
         insights = []
@@ -287,7 +636,7 @@ def weather():
             })
 
         if result["sunrise"] and result["sunset"]:
-            daylight_seconds = (sys.get("sunset") or 0) - (sys.get("sunrise") or 0)
+            daylight_seconds = (data_current["sunset"] or 0) - (data_current["sunrise"] or 0)
             if daylight_seconds > 0:
                 hours, remainder = divmod(daylight_seconds, 3600)
                 minutes = remainder // 60
@@ -300,15 +649,24 @@ def weather():
         result["insights"] = insights
 
         # Pronóstico 5 días (resumen diario)
-        forecast5, from_cache_forecast = fetch_forecast(city, units, lang)
+        forecast5, from_cache_forecast = fut_forecast.result()
 
-        return render_template("index.html",
+        html = render_template("index.html",
                                result=result,
                                forecast5=forecast5,   # <-- pásalo a la plantilla
                                error=None,
                                default_units=units,
                                default_lang=lang,
                                from_cache=from_cache_current or from_cache_forecast)
+        # Sólo guardamos páginas armadas 100% desde cache: así el indicador
+        # "Datos servidos desde caché" sigue siendo correcto al reutilizarlas.
+        if from_cache_current and from_cache_forecast:
+            expires = [_data_expires_at(kind, city, units, lang)
+                       for kind in ("current", "forecast")]
+            if None not in expires:
+                with _lock:
+                    _html_cache[html_key] = (min(expires), html)
+        return html
     except Exception as e:
         return render_template("index.html",
                                result=None,
@@ -322,48 +680,75 @@ def weather():
 # Endpoints JSON (AJAX)
 # ------------------------------
 
-@app.post("/api/weather")
+def _json_response(payload, status=200):
+    """Serializa con orjson (más rápido que jsonify) y arma la respuesta."""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype="application/json")
+
+def _cacheable_json(payload, etag_source, expires_at):
+    """
+    Respuesta JSON cacheable por navegador/CDN: Cache-Control con el tiempo
+    que les queda a los datos en el cache del servidor (`expires_at`, reloj
+    time.monotonic; None => no cachear) y ETag débil derivado de `etag_source`
+    (sólo los datos del clima, sin `from_cache`, para que el mismo clima dé el
+    mismo ETag sin importar el estado del cache del servidor). Si el cliente
+    envía un If-None-Match que coincide, responde 304 sin cuerpo.
+    """
+    etag = hashlib.blake2b(orjson.dumps(etag_source), digest_size=8).hexdigest()
+    # Flask-Compress agrega ':gzip' (o el algoritmo usado) al ETag si comprime;
+    # en el 304 devolvemos el mismo validador que el cliente recibió con el 200.
+    client_tags = request.if_none_match.as_set(include_weak=True)
+    matched = next((tag for tag in client_tags if tag.split(":", 1)[0] == etag), None)
+    if matched is not None:
+        resp = app.response_class(status=304)
+        resp.set_etag(matched, weak=True)
+    else:
+        resp = app.response_class(orjson.dumps(payload), mimetype="application/json")
+        resp.set_etag(etag, weak=True)
+    max_age = max(0, int(expires_at - time.monotonic())) if expires_at else 0
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return resp
+
+def _api_args():
+    """Lee { city, units, lang } de la query string (GET) o del cuerpo JSON (POST)."""
+    data = request.args if request.method == "GET" else (request.get_json(silent=True) or {})
+    city = (data.get("city") or "").strip()
+    units = data.get("units", DEFAULT_UNITS)
+    lang  = data.get("lang",  DEFAULT_LANG)
+    return city, units, lang
+
+@app.route("/api/weather", methods=["GET", "POST"])
 def weather_api():
     """
     Modo AJAX: retorna JSON del clima actual para que el front lo pinte.
-    Espera JSON: { city, units, lang }
+    Espera { city, units, lang } por query string (GET, cacheable) o JSON (POST).
     """
     if not API_KEY:
-        return jsonify({"error": "Falta OPENWEATHER_API_KEY en .env"}), 400
+        return _json_response({"error": "Falta OPENWEATHER_API_KEY en .env"}, 400)
 
-    data = request.get_json(silent=True) or {}
-    city = (data.get("city") or "").strip()
-    units = data.get("units", DEFAULT_UNITS)
-    lang  = data.get("lang",  DEFAULT_LANG)
+    city, units, lang = _api_args()
     if not city:
-        return jsonify({"error": "Ingresa una ciudad."}), 400
+        return _json_response({"error": "Ingresa una ciudad."}, 400)
 
     try:
         cw, from_cache = fetch_weather(city, units, lang)
 
-        w = cw["weather"][0] if cw.get("weather") else {}
-        m = cw.get("main", {})
-        wind = cw.get("wind", {})
-
-        tz_offset = cw.get("timezone", 0) or 0
+        tz_offset = cw["timezone"] or 0
         result = {
-            "city": f'{cw.get("name", city)}, {cw.get("sys",{}).get("country","")}'.strip(", "),
-            "temp": m.get("temp"),
-            "feels_like": m.get("feels_like"),
-            "humidity": m.get("humidity"),
-            "pressure": m.get("pressure"),
-            "desc": w.get("description",""),
-            "icon": w.get("icon"),
-            "wind_speed": wind.get("speed"),
+            "city": f'{cw["name"] or city}, {cw["country"]}'.strip(", "),
+            "temp": cw["temp"],
+            "feels_like": cw["feels_like"],
+            "humidity": cw["humidity"],
+            "pressure": cw["pressure"],
+            "desc": cw["desc"],
+            "icon": cw["icon"],
+            "wind_speed": cw["wind_speed"],
             "units": units,
-            "tz_offset": cw.get("timezone"),  # segundos de diferencia vs UTC
-            "dt": cw.get("dt"),               # timestamp base (UTC) de la medición
+            "tz_offset": cw["timezone"],  # segundos de diferencia vs UTC
+            "dt": cw["dt"],               # timestamp base (UTC) de la medición
+            "sunrise": _format_local_time(cw["sunrise"], tz_offset),
+            "sunset": _format_local_time(cw["sunset"], tz_offset),
+            "clouds": cw["clouds"],
         }
-        result.update({
-            "sunrise": _format_local_time(cw.get("sys", {}).get("sunrise"), tz_offset),
-            "sunset": _format_local_time(cw.get("sys", {}).get("sunset"), tz_offset),
-            "clouds": cw.get("clouds", {}).get("all"),
-        })
 
         insights = []
         if result["sunrise"]:
@@ -385,9 +770,8 @@ def weather_api():
                 "description": "Cobertura de nubes reportada",
             })
 
-        sys_block = cw.get("sys", {})
-        sunrise_raw = sys_block.get("sunrise")
-        sunset_raw = sys_block.get("sunset")
+        sunrise_raw = cw["sunrise"]
+        sunset_raw = cw["sunset"]
         if sunrise_raw and sunset_raw and sunrise_raw < sunset_raw:
             daylight_seconds = sunset_raw - sunrise_raw
             hours, remainder = divmod(daylight_seconds, 3600)
@@ -399,37 +783,38 @@ def weather_api():
             })
 
         result["insights"] = insights
-        return jsonify({"result": result, "from_cache": from_cache})
+        return _cacheable_json({"result": result, "from_cache": from_cache}, result,
+                               _data_expires_at("current", city, units, lang))
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return _json_response({"error": str(e)}, 400)
 
-@app.post("/api/forecast")
+@app.route("/api/forecast", methods=["GET", "POST"])
 def forecast_api():
     """
     Modo AJAX: retorna JSON con el pronóstico resumido a 5 días.
-    Espera JSON: { city, units, lang }
+    Espera { city, units, lang } por query string (GET, cacheable) o JSON (POST).
     Respuesta: { forecast5: [ {date, day, temp_min, temp_max, desc, icon, pop}, ... ], from_cache }
     """
     if not API_KEY:
-        return jsonify({"error": "Falta OPENWEATHER_API_KEY en .env"}), 400
+        return _json_response({"error": "Falta OPENWEATHER_API_KEY en .env"}, 400)
 
-    data = request.get_json(silent=True) or {}
-    city = (data.get("city") or "").strip()
-    units = data.get("units", DEFAULT_UNITS)
-    lang  = data.get("lang",  DEFAULT_LANG)
+    city, units, lang = _api_args()
     if not city:
-        return jsonify({"error": "Ingresa una ciudad."}), 400
+        return _json_response({"error": "Ingresa una ciudad."}, 400)
 
     try:
         forecast5, from_cache = fetch_forecast(city, units, lang)
-        return jsonify({"forecast5": forecast5, "from_cache": from_cache})
+        return _cacheable_json({"forecast5": forecast5, "from_cache": from_cache}, forecast5,
+                               _data_expires_at("forecast", city, units, lang))
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return _json_response({"error": str(e)}, 400)
 
 # ------------------------------
 
 if __name__ == "__main__":
     # `flask run` también funciona; esto es útil para `python app.py`
+    # En producción: `gunicorn -c gunicorn_conf.py app:app`
+    atexit.register(save_geocache)
     app.run(debug=True)
 
 
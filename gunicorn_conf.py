@@ -0,0 +1,21 @@
+# Configuración de gunicorn para producción:
+#   gunicorn -c gunicorn_conf.py app:app
+#
+# Workers con hilos (gthread): las llamadas a OpenWeather son I/O, así que
+# varios hilos por proceso comparten el cache en memoria y la sesión HTTP.
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Importa la app una vez en el proceso maestro antes de hacer fork de los workers
+preload_app = True
+# Un poco más que el timeout (10 s) de las llamadas a OpenWeather
+timeout = 30
+
+
+def worker_exit(server, worker):
+    """Cada worker guarda su geocoding al salir (el maestro sólo tiene la foto inicial)."""
+    from app import save_geocache
+    save_geocache()
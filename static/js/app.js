@@ -461,7 +461,8 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!validateCityField()) return;
 
     const q = city.value.trim();
-    const payload = { city: q, units: units.value, lang: lang.value };
+    // GET con query string: permite que el navegador/CDN cachee la respuesta
+    const query = new URLSearchParams({ city: q, units: units.value, lang: lang.value }).toString();
 
     // Deshabilita botón mientras consulta
     submitBtn.disabled = true;
@@ -478,10 +479,7 @@ document.addEventListener('DOMContentLoaded', () => {
       const weatherController = new AbortController();
       inFlight.weather = weatherController;
 
-      const resp = await fetchWithTimeout('/api/weather', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload),
+      const resp = await fetchWithTimeout(`/api/weather?${query}`, {
         signal: weatherController.signal
       }, 10000);
 
@@ -498,10 +496,7 @@ document.addEventListener('DOMContentLoaded', () => {
       const forecastController = new AbortController();
       inFlight.forecast = forecastController;
 
-      const respF = await fetchWithTimeout('/api/forecast', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload),
+      const respF = await fetchWithTimeout(`/api/forecast?${query}`, {
         signal: forecastController.signal
       }, 10000);
 